@@ -0,0 +1,260 @@
+"""
+Contention benchmark for modep_common.quota
+
+Many threads submit jobs for the same user at once, hold the slot briefly and
+finish the job. After every grant the committed number of active jobs is read
+back from the database; its peak must never exceed the quota, and once all
+threads are done both the jobs table and the user's counter must be back to
+zero, also after several sessions finish the same job at once. Exits
+non-zero if either check fails. `--mode scan` runs the old count-then-insert
+check for comparison.
+
+    python benchmarks/admission.py --threads 16 --concurrency 4
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from bench import get_app
+from modep_common import quota
+from modep_common.enums import JobStatus
+from modep_common.models import TabularFramework, User, UserJobCounter, db
+
+
+logger = logging.getLogger(__name__)
+
+
+class Tracker:
+    """Tallies submissions and the most active jobs seen in the database"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.granted = 0
+        self.denied = 0
+        self.errors = 0
+        self.peak_active = 0
+        self.peak_counter = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def observe(self, active, counter):
+        with self.lock:
+            self.peak_active = max(self.peak_active, active)
+            self.peak_counter = max(self.peak_counter, counter)
+
+
+def read_active(user_pk):
+    """Committed number of active jobs, from the jobs table and the counter"""
+    active = quota._count_active(user_pk)
+    counter = (
+        db.session.query(UserJobCounter.active)
+        .filter(UserJobCounter.user_pk == user_pk)
+        .scalar()
+    )
+    # end the read transaction, SQLite would otherwise keep its lock
+    db.session.rollback()
+    return active, counter or 0
+
+
+def submit_counter(user_pk, concurrency):
+    job = TabularFramework(user_pk=user_pk, framework_name="bench")
+    if not quota.acquire_slot(job, concurrency):
+        db.session.rollback()
+        return None
+    db.session.commit()
+    return job
+
+
+def submit_scan(user_pk, concurrency):
+    if quota._count_active(user_pk) >= concurrency:
+        db.session.rollback()
+        return None
+    job = TabularFramework(user_pk=user_pk, framework_name="bench")
+    job.status = JobStatus.CREATED.name
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+MODES = {
+    "counter": submit_counter,
+    "scan": submit_scan,
+}
+
+
+def finish(job, retries=100):
+    for _ in range(retries):
+        try:
+            job.status = JobStatus.SUCCESS.name
+            db.session.commit()
+            return
+        except OperationalError:
+            db.session.rollback()
+    raise RuntimeError(f"Couldn't finish job {job.id}")
+
+
+def worker(app, mode, user_pk, concurrency, submissions, hold_seconds, tracker):
+    submit = MODES[mode]
+    with app.app_context():
+        for _ in range(submissions):
+            try:
+                job = submit(user_pk, concurrency)
+            except OperationalError:
+                # e.g. SQLite "database is locked"
+                db.session.rollback()
+                tracker.add(errors=1)
+                continue
+            if job is None:
+                tracker.add(denied=1)
+                continue
+            tracker.add(granted=1)
+            tracker.observe(*read_active(user_pk))
+            time.sleep(hold_seconds)
+            finish(job)
+        db.session.remove()
+
+
+def finish_together(app, user_pk, sessions):
+    """
+    Regression check: `sessions` sessions load the same active job and all
+    finish it at once, the counter must only drop by one
+    """
+    with app.app_context():
+        job = TabularFramework(user_pk=user_pk, framework_name="bench")
+        if not quota.acquire_slot(job, None):
+            raise RuntimeError("Couldn't submit the job")
+        db.session.commit()
+        job_pk = job.pk
+        db.session.remove()
+
+    barrier = threading.Barrier(sessions)
+
+    def finisher():
+        with app.app_context():
+            job = TabularFramework.query.get(job_pk)
+            barrier.wait()
+            finish(job)
+            db.session.remove()
+
+    threads = [threading.Thread(target=finisher) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=sorted(MODES), default="counter")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--submissions", type=int, default=50, help="per thread")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--hold-ms", type=float, default=1.0)
+    parser.add_argument("--history", type=int, default=10000, help="finished jobs")
+    parser.add_argument(
+        "--finishers",
+        type=int,
+        default=8,
+        help="sessions finishing the same job at once in the regression check",
+    )
+    parser.add_argument(
+        "--db-uri",
+        default=None,
+        help="scratch database, its tables get dropped (default: temporary SQLite)",
+    )
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix="modep-admission-")
+    try:
+        db_uri = args.db_uri or (
+            "sqlite:///" + os.path.join(workdir, "admission.db") + "?timeout=30"
+        )
+        app = get_app(db_uri, instrument=False)
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.bulk_insert_mappings(
+                User, [dict(pk=1, id="bench", email="bench@example.com", tier="free")]
+            )
+            # finished jobs that the scan check has to wade through
+            db.session.bulk_insert_mappings(
+                TabularFramework,
+                [
+                    dict(id=f"history-{i}", user_pk=1, status=JobStatus.SUCCESS.name)
+                    for i in range(args.history)
+                ],
+            )
+            db.session.commit()
+            db.session.remove()
+
+        tracker = Tracker()
+        threads = [
+            threading.Thread(
+                target=worker,
+                args=(
+                    app,
+                    args.mode,
+                    1,
+                    args.concurrency,
+                    args.submissions,
+                    args.hold_ms / 1000,
+                    tracker,
+                ),
+            )
+            for _ in range(args.threads)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+        if args.mode == "counter":
+            finish_together(app, 1, args.finishers)
+        with app.app_context():
+            final_active, final_counter = read_active(1)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "mode": args.mode,
+        "db": db_uri.split(":", 1)[0],
+        "threads": args.threads,
+        "concurrency": args.concurrency,
+        "history": args.history,
+        "finishers": args.finishers if args.mode == "counter" else 0,
+        "seconds": seconds,
+        "submissions_per_second": args.threads * args.submissions / seconds,
+        "granted": tracker.granted,
+        "denied": tracker.denied,
+        "errors": tracker.errors,
+        "peak_active": tracker.peak_active,
+        "peak_counter": tracker.peak_counter,
+        "final_active": final_active,
+        "final_counter": final_counter,
+        "over_admitted": tracker.peak_active > args.concurrency,
+        "counter_consistent": final_active == final_counter == 0,
+    }
+    print(json.dumps(output, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    return 0 if output["counter_consistent"] and not output["over_admitted"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
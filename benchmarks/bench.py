@@ -0,0 +1,423 @@
+"""
+Offline benchmarks for modep_common
+
+Seeds a SQLite (or local Postgres) database, uses a local directory in place
+of the GCS bucket and writes the timings to a JSON file that can be compared
+against a previous run:
+
+    python benchmarks/bench.py --rows 100000 --out before.json
+    python benchmarks/bench.py --rows 100000 --out after.json --compare before.json
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from modep_common import metrics  # noqa: E402
+from modep_common import schemas  # noqa: E402
+from modep_common.enums import JobStatus  # noqa: E402
+from modep_common.io import StorageClient  # noqa: E402
+from modep_common.models import (  # noqa: E402
+    TabularFramework,
+    TabularFrameworkFlight,
+    User,
+    db,
+)
+from modep_common.quota import init_quota  # noqa: E402
+from modep_common.shell import run_cmd  # noqa: E402
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 10000
+# set by --overhead, see measure()
+MEASURE_OVERHEAD = False
+FRAMEWORK_NAMES = ["autogluon", "flaml", "h2o", "lightgbm", "xgboost"]
+
+
+class LocalBlob:
+    """The parts of google.cloud.storage.Blob that StorageClient uses"""
+
+    def __init__(self, path):
+        self.path = path
+        self.chunk_size = None
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self.path, filename)
+
+    def upload_from_filename(self, filename):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+    def delete(self):
+        os.remove(self.path)
+
+
+class LocalBucket:
+    """Stand-in for the GCS bucket that keeps blobs in a local directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def blob(self, gs_path):
+        return LocalBlob(os.path.join(self.root, gs_path.lstrip("/")))
+
+
+class LocalStorageClient(StorageClient):
+    """StorageClient on a LocalBucket, so the real (instrumented) methods run"""
+
+    def __init__(self, root):
+        self.client = None
+        self.bucket = LocalBucket(root)
+
+
+def get_app(db_uri, instrument):
+    app = Flask("bench")
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_uri
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    init_quota()
+    if instrument:
+        with app.app_context():
+            metrics.instrument_engine(db.engine)
+    return app
+
+
+def seed(rows, seed_value=0):
+    """
+    Insert `rows` TabularFramework rows spread over rows / 10 flights and
+    rows / 100 users. Returns the users' api keys and the framework ids.
+    """
+    rng = random.Random(seed_value)
+    n_users = max(rows // 100, 1)
+    n_flights = max(rows // 10, 1)
+    # hashing a real password per user would dominate the seeding time
+    pwd_hash = "pbkdf2:sha256:260000$bench$" + "0" * 64
+
+    api_keys = [uuid.uuid4().hex for _ in range(n_users)]
+    users = [
+        dict(
+            pk=i + 1,
+            id=str(uuid.uuid4()),
+            email=f"user{i}@example.com",
+            pwd_hash=pwd_hash,
+            nb_requests=0,
+            ip="127.0.0.1",
+            api_key=api_keys[i],
+            tier="free",
+        )
+        for i in range(n_users)
+    ]
+    _insert(User, users)
+
+    flights = [
+        dict(
+            pk=i + 1,
+            id=str(uuid.uuid4()),
+            user_pk=i % n_users + 1,
+            framework_names=FRAMEWORK_NAMES,
+            train_ids=[str(uuid.uuid4())],
+            test_ids=[str(uuid.uuid4())],
+            target="class",
+            max_runtime_seconds=600,
+            status=JobStatus.SUCCESS.name,
+            info="",
+        )
+        for i in range(n_flights)
+    ]
+    _insert(TabularFrameworkFlight, flights)
+
+    framework_ids = []
+    for start in range(0, rows, CHUNK_SIZE):
+        chunk = []
+        for i in range(start, min(start + CHUNK_SIZE, rows)):
+            flight_pk = i % n_flights + 1
+            framework_id = str(uuid.uuid4())
+            framework_ids.append(framework_id)
+            chunk.append(
+                dict(
+                    id=framework_id,
+                    user_pk=(flight_pk - 1) % n_users + 1,
+                    framework_name=rng.choice(FRAMEWORK_NAMES),
+                    train_ids=flights[flight_pk - 1]["train_ids"],
+                    test_ids=flights[flight_pk - 1]["test_ids"],
+                    target="class",
+                    max_runtime_seconds=600,
+                    status=rng.choice(list(JobStatus)).name,
+                    info="",
+                    metric_name="auc",
+                    metric_value=rng.random(),
+                    fold_results=[{"fold": f, "auc": rng.random()} for f in range(2)],
+                    n_folds=2,
+                    flight_pk=flight_pk,
+                )
+            )
+        _insert(TabularFramework, chunk)
+    logger.info("Seeded %i users, %i flights, %i frameworks", n_users, n_flights, rows)
+    return api_keys, framework_ids
+
+
+def _insert(model, mappings):
+    for start in range(0, len(mappings), CHUNK_SIZE):
+        db.session.bulk_insert_mappings(model, mappings[start : start + CHUNK_SIZE])
+        db.session.commit()
+
+
+def _timeit(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _stats(times):
+    times = sorted(times)
+    return {
+        "n": len(times),
+        "min": times[0],
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "p95": times[min(int(round(0.95 * (len(times) - 1))), len(times) - 1)],
+    }
+
+
+def measure(func, repeat, warmup=1):
+    """
+    Time `func`. With MEASURE_OVERHEAD each iteration runs it once with and
+    once without instrumentation, in alternating order, so that drift in the
+    machine's speed affects both sides equally.
+    """
+    for _ in range(warmup):
+        func()
+    if not MEASURE_OVERHEAD:
+        return _stats([_timeit(func) for _ in range(repeat)])
+
+    on, off = [], []
+    for i in range(repeat):
+        for enabled in (i % 2 == 0, i % 2 != 0):
+            metrics.set_enabled(enabled)
+            (on if enabled else off).append(_timeit(func))
+    metrics.set_enabled(True)
+    result = _stats(on)
+    result["median_off"] = statistics.median(off)
+    result["overhead"] = result["median"] / result["median_off"] - 1
+    return result
+
+
+def bench_db(repeat, api_keys, framework_ids):
+    rng = random.Random(1)
+    results = {}
+
+    def auth_lookup():
+        User.query.filter_by(api_key=rng.choice(api_keys)).first()
+
+    results["auth_lookup"] = measure(auth_lookup, repeat)
+
+    def flight_listing():
+        user = User.query.filter_by(api_key=rng.choice(api_keys)).first()
+        flights = TabularFrameworkFlight.query.filter_by(user_pk=user.pk).all()
+        for flight in flights:
+            flight.frameworks
+
+    results["flight_listing"] = measure(flight_listing, repeat)
+
+    flights = TabularFrameworkFlight.query.limit(50).all()
+    frameworks = TabularFramework.query.limit(500).all()
+    flight_schema = schemas.TabularFrameworkFlightSchema(many=True)
+    framework_schema = schemas.TabularFrameworkSchema(many=True)
+    results["schema_dump_flights"] = measure(
+        lambda: flight_schema.dump(flights), repeat
+    )
+    results["schema_dump_frameworks"] = measure(
+        lambda: framework_schema.dump(frameworks), repeat
+    )
+    db.session.expunge_all()
+
+    def status_update():
+        TabularFramework.query.filter_by(id=rng.choice(framework_ids)).update(
+            {"status": JobStatus.RUNNING.name}
+        )
+        db.session.commit()
+
+    results["status_update"] = measure(status_update, repeat)
+
+    def bulk_insert():
+        db.session.add_all(
+            [
+                TabularFramework(
+                    user_pk=1,
+                    framework_name="lightgbm",
+                    train_ids=["a"],
+                    test_ids=["b"],
+                    target="class",
+                    max_runtime_seconds=60,
+                )
+                for _ in range(1000)
+            ]
+        )
+        db.session.commit()
+
+    results["bulk_insert_1000"] = measure(bulk_insert, max(repeat // 10, 3))
+    return results
+
+
+def bench_storage(repeat, workdir):
+    results = {}
+    sc = LocalStorageClient(os.path.join(workdir, "bucket"))
+    for mbytes in (1, 64):
+        src_path = os.path.join(workdir, f"blob-{mbytes}mb.bin")
+        with open(src_path, "wb") as f:
+            f.write(os.urandom(mbytes * 1024 * 1024))
+        gs_path = f"bench/blob-{mbytes}mb.bin"
+        dest_path = os.path.join(workdir, f"download-{mbytes}mb.bin")
+        results[f"upload_{mbytes}mb"] = measure(
+            lambda: sc.upload(src_path, gs_path), repeat
+        )
+        results[f"download_{mbytes}mb"] = measure(
+            lambda: sc.download(gs_path, dest_path), repeat
+        )
+    return results
+
+
+def bench_shell(repeat):
+    results = {}
+    results["run_cmd_noop"] = measure(lambda: run_cmd("true"), repeat)
+    results["run_cmd_100k_lines"] = measure(
+        lambda: run_cmd("seq 100000"), max(repeat // 10, 3)
+    )
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f"{'benchmark':32s} {'before':>12s} {'after':>12s} {'change':>8s}")
+    for name, stats in sorted(results["results"].items()):
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        change = stats["median"] / before["median"] - 1
+        print(
+            f"{name:32s} {before['median']:12.6f} {stats['median']:12.6f} {change:+8.1%}"
+        )
+
+
+def report_overhead(results):
+    print(f"{'benchmark':32s} {'off':>12s} {'on':>12s} {'overhead':>9s}")
+    ratios = []
+    for name, stats in sorted(results.items()):
+        ratios.append(1 + stats["overhead"])
+        print(
+            f"{name:32s} {stats['median_off']:12.6f} {stats['median']:12.6f}"
+            f" {stats['overhead']:+9.2%}"
+        )
+    print(
+        f"{'geometric mean':32s} {'':12s} {'':12s} {geometric_mean(ratios) - 1:+9.2%}"
+    )
+
+
+def geometric_mean(values):
+    return math.exp(statistics.mean(math.log(v) for v in values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--rows", type=int, default=10000, help="e.g. 10000, 100000, 1000000"
+    )
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument(
+        "--db-uri",
+        default=None,
+        help="scratch database, its tables get dropped (default: temporary SQLite)",
+    )
+    parser.add_argument(
+        "--no-metrics", action="store_true", help="disable all instrumentation"
+    )
+    parser.add_argument(
+        "--overhead",
+        action="store_true",
+        help="time every benchmark with and without instrumentation",
+    )
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", default=None, help="JSON file of a previous run")
+    args = parser.parse_args()
+
+    global MEASURE_OVERHEAD
+    MEASURE_OVERHEAD = args.overhead
+    if args.no_metrics and args.overhead:
+        parser.error("--overhead needs the instrumentation")
+    metrics.set_enabled(not args.no_metrics)
+
+    logging.basicConfig(level=logging.INFO)
+    # run_cmd logs every output line at debug level
+    logging.getLogger("modep_common.shell").setLevel(logging.INFO)
+    # and StorageClient logs every transfer
+    logging.getLogger("modep_common.io").setLevel(logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix="modep-bench-")
+    try:
+        db_uri = args.db_uri or "sqlite:///" + os.path.join(workdir, "bench.db")
+        app = get_app(db_uri, instrument=not args.no_metrics)
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            start = time.perf_counter()
+            api_keys, framework_ids = seed(args.rows)
+            seed_seconds = time.perf_counter() - start
+
+            results = {}
+            results.update(bench_db(args.repeat, api_keys, framework_ids))
+            results.update(bench_storage(max(args.repeat // 10, 3), workdir))
+            results.update(bench_shell(args.repeat))
+            db.session.remove()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "db": db_uri.split(":", 1)[0],
+        "rows": args.rows,
+        "repeat": args.repeat,
+        "metrics": not args.no_metrics,
+        "seed_seconds": seed_seconds,
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    logger.info("Wrote: '%s'", args.out)
+
+    if args.overhead:
+        report_overhead(results)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Import-time budget for modep_common
+
+Imports each module in a fresh interpreter with `python -X importtime` and
+fails if it pulls in a module it shouldn't, or if modep_common's own import
+time goes over budget. The own time is the sum of the "self" column of the
+`modep_common.*` lines, so third-party imports (Flask, marshmallow, ...)
+don't count towards it:
+
+    python benchmarks/importtime.py
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIGHT = ("flask", "sqlalchemy", "google.cloud")
+
+# module -> (budget in ms for modep_common's own import time,
+#            modules that must not be imported)
+BUDGETS = {
+    "modep_common.enums": (5, LIGHT + ("marshmallow",)),
+    "modep_common.settings": (5, LIGHT),
+    "modep_common.shell": (15, LIGHT),
+    "modep_common.schemas": (10, LIGHT),
+    "modep_common.io": (15, ("google.cloud",)),
+    "modep_common.models": (75, ("google.cloud",)),
+}
+
+
+def import_time(module):
+    """
+    Returns the time in ms spent in modep_common modules themselves while
+    importing `module`, and the set of modules that got loaded
+    """
+    code = f"import sys, {module}; print('\\n'.join(sys.modules))"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    self_us = 0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        head, _, name = line.split("|")
+        name = name.strip()
+        if name == "modep_common" or name.startswith("modep_common."):
+            self_us += int(head.split(":")[1])
+    return self_us / 1000, set(proc.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+
+    failures = []
+    for module, (budget_ms, forbidden) in BUDGETS.items():
+        results = [import_time(module) for _ in range(args.repeat)]
+        own_ms = min(ms for ms, _ in results)
+        loaded = results[0][1]
+        status = "ok"
+        if own_ms > budget_ms:
+            status = "OVER BUDGET"
+            failures.append(module)
+        heavy = sorted(m for m in forbidden if m in loaded)
+        if heavy:
+            status = "IMPORTS " + ", ".join(heavy)
+            failures.append(module)
+        print(f"{module:24s} {own_ms:6.1f} ms / {budget_ms:3d} ms  {status}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import logging
+import os
+
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.feather
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# extension -> format name
+FORMATS = {
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+}
+
+# Parquet is compressed and column/row-group selective, the Arrow IPC file is
+# left uncompressed so that memory-mapped reads don't copy
+DEFAULT_FORMAT = "parquet"
+PARQUET_COMPRESSION = "zstd"
+ROW_GROUP_SIZE = 128 * 1024
+
+
+def is_columnar(path):
+    _, ext = os.path.splitext(path)
+    return ext.lower() in FORMATS
+
+
+def columnar_path(path, fmt=DEFAULT_FORMAT):
+    """Path of the columnar copy stored next to the original file"""
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"Unknown columnar format: {fmt}")
+    root, _ = os.path.splitext(path)
+    return f"{root}.{fmt}"
+
+
+def read_table(path, columns=None):
+    """Read a CSV or columnar file into an Arrow table"""
+    if is_columnar(path):
+        return read_columnar(path, columns=columns)
+    convert_options = pyarrow.csv.ConvertOptions(include_columns=columns)
+    return pyarrow.csv.read_csv(path, convert_options=convert_options)
+
+
+def write_table(table, dest_path):
+    _, ext = os.path.splitext(dest_path)
+    fmt = FORMATS.get(ext.lower())
+    if fmt == "parquet":
+        pq.write_table(
+            table,
+            dest_path,
+            compression=PARQUET_COMPRESSION,
+            row_group_size=ROW_GROUP_SIZE,
+        )
+    elif fmt == "arrow":
+        pyarrow.feather.write_feather(
+            table, dest_path, compression="uncompressed", chunksize=ROW_GROUP_SIZE
+        )
+    else:
+        raise ValueError(f"Not a columnar path: {dest_path}")
+    return dest_path
+
+
+def convert(src_path, dest_path=None, fmt=DEFAULT_FORMAT):
+    """Convert a CSV (or other columnar) file to a columnar file next to it"""
+    if dest_path is None:
+        dest_path = columnar_path(src_path, fmt)
+    if os.path.abspath(src_path) == os.path.abspath(dest_path):
+        return dest_path
+    table = read_table(src_path)
+    write_table(table, dest_path)
+    logger.info("Converted: '%s' to '%s'", src_path, dest_path)
+    return dest_path
+
+
+def read_columnar(path, columns=None, row_groups=None):
+    """
+    Memory-map a columnar file and read only the requested columns and
+    row groups (record batches for Arrow IPC files)
+    """
+    _, ext = os.path.splitext(path)
+    fmt = FORMATS.get(ext.lower())
+    if fmt == "parquet":
+        pf = pq.ParquetFile(path, memory_map=True)
+        if row_groups is None:
+            return pf.read(columns=columns)
+        return pf.read_row_groups(row_groups, columns=columns)
+    if fmt == "arrow":
+        # zero-copy: buffers point into the mapped file
+        reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+        if row_groups is None:
+            row_groups = range(reader.num_record_batches)
+        batches = [reader.get_batch(i) for i in row_groups]
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+        if columns is not None:
+            table = table.select(columns)
+        return table
+    raise ValueError(f"Not a columnar path: {path}")
+
+
+def convert_dataset(dataset, sc=None, fmt=DEFAULT_FORMAT):
+    """
+    Convert a `TabularDataset` to a columnar file next to the original and,
+    if a StorageClient is given, upload it next to `dataset.gcp_path`.
+    Returns the local path of the columnar copy.
+    """
+    dest_path = convert(dataset.path, fmt=fmt)
+    if sc is not None and dataset.gcp_path is not None:
+        sc.upload(dest_path, columnar_path(dataset.gcp_path, fmt))
+    return dest_path
+
+
+def convert_predictions(preds, sc=None, fmt=DEFAULT_FORMAT):
+    """Same as `convert_dataset` for `TabularFrameworkPredictions` rows"""
+    dest_paths = []
+    for pred in preds:
+        dest_path = convert(pred.path, fmt=fmt)
+        if sc is not None and pred.gcp_path is not None:
+            sc.upload(dest_path, columnar_path(pred.gcp_path, fmt))
+        dest_paths.append(dest_path)
+    return dest_paths
+
+
+def find_columnar(path):
+    """
+    Path of an up-to-date columnar copy of `path`, or None if there's none or
+    it's older than the source (e.g. a fold that was re-run)
+    """
+    if is_columnar(path):
+        return path
+    src_mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    for fmt in ("arrow", "parquet"):
+        candidate = columnar_path(path, fmt)
+        if not os.path.exists(candidate):
+            continue
+        if src_mtime is not None and os.path.getmtime(candidate) < src_mtime:
+            logger.info("Ignoring stale columnar copy: '%s'", candidate)
+            continue
+        return candidate
+    return None
+
+
+def read_dataset(dataset, columns=None, row_groups=None, prefer_columnar=True):
+    """
+    Read a `TabularDataset`, through its columnar copy if there's an
+    up-to-date one, falling back to parsing the original file
+    """
+    path = find_columnar(dataset.path) if prefer_columnar else None
+    if path is not None:
+        return read_columnar(path, columns=columns, row_groups=row_groups)
+    if row_groups is not None:
+        raise ValueError(f"No columnar copy to read row groups from: {dataset.path}")
+    return read_table(dataset.path, columns=columns)
+
+
+def merge_predictions(preds, columns=None, prefer_columnar=True):
+    """
+    Concatenate the per-fold predictions of `TabularFrameworkPredictions`
+    rows into a single Arrow table with a `fold` column, which replaces any
+    `fold` column already in the files. Columns whose type was inferred
+    differently per fold (e.g. int64 and double) are widened to a common type.
+    """
+    tables = []
+    for pred in sorted(preds, key=lambda p: p.fold):
+        path = pred.path
+        if prefer_columnar:
+            path = find_columnar(path) or path
+        table = read_table(path, columns=columns)
+        fold = pa.array([pred.fold] * table.num_rows, type=pa.int32())
+        index = table.schema.get_field_index("fold")
+        if index >= 0:
+            table = table.set_column(index, "fold", fold)
+        else:
+            table = table.append_column("fold", fold)
+        tables.append(table)
+    if not tables:
+        return None
+    return pa.concat_tables(tables, promote_options="permissive")
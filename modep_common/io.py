@@ -2,19 +2,32 @@ import logging
 import os
 import tempfile
 
-from google.cloud import storage
-
 from modep_common import settings
+from modep_common.metrics import timed
 
 
 logger = logging.getLogger(__name__)
 
 
+def _download_size(result, *args, **kwargs):
+    # download returns the destination path
+    return os.path.getsize(result)
+
+
+def _upload_size(result, *args, **kwargs):
+    # args are (self, src_path, dest_path)
+    src_path = kwargs["src_path"] if "src_path" in kwargs else args[1]
+    return os.path.getsize(src_path)
+
+
 class StorageClient:
     def __init__(self):
+        from google.cloud import storage
+
         self.client = storage.Client()
         self.bucket = self.client.bucket(settings.GCP_BUCKET)
 
+    @timed("modep_storage", size=_download_size)
     def download(self, gs_path, dest_path=None):
         if dest_path is None:
             _, ext = os.path.splitext(gs_path)
@@ -24,6 +37,7 @@ class StorageClient:
         logger.info("Downloaded: '%s' to '%s'", gs_path, dest_path)
         return dest_path
 
+    @timed("modep_storage", size=_upload_size)
     def upload(self, src_path, dest_path):
         blob = self.bucket.blob(dest_path)
 
@@ -34,6 +48,7 @@ class StorageClient:
         blob.upload_from_filename(src_path)
         logger.info("Uploaded: '%s' to '%s'", src_path, dest_path)
 
+    @timed("modep_storage")
     def delete(self, gs_path):
         blob = self.bucket.blob(gs_path)
         blob.delete()
@@ -0,0 +1,330 @@
+import bisect
+import functools
+import logging
+import re
+import threading
+import time
+
+from modep_common import settings
+
+
+logger = logging.getLogger(__name__)
+
+# seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+# bytes
+SIZE_BUCKETS = tuple(1024**2 * 2**i for i in range(-4, 13))
+# rows
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+MAX_CACHED_STATEMENTS = 1000
+
+
+class Histogram:
+    """Cumulative histogram with fixed upper bounds, like a Prometheus one"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """In-process store of histograms and counters keyed by name and labels"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        """Get or create a histogram, callers must hold `lock` to observe"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            return hist
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        hist = self.histogram(name, buckets, **labels)
+        with self.lock:
+            hist.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        # histograms are zeroed rather than dropped, instrumented code may
+        # hold on to them
+        with self.lock:
+            for hist in self.histograms.values():
+                hist.reset()
+            self.counters.clear()
+
+    def export(self, exporter=None):
+        if exporter is None:
+            exporter = EXPORTERS[settings.METRICS_EXPORTER]()
+        with self.lock:
+            return exporter.export(self)
+
+
+registry = Registry()
+
+# read from settings.METRICS_ENABLED on first use, it's checked on every
+# instrumented call so it's cached here rather than read from the environment
+_enabled = None
+
+
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = settings.METRICS_ENABLED
+    return _enabled
+
+
+def set_enabled(enabled):
+    """Turn recording on or off at runtime, overriding METRICS_ENABLED"""
+    global _enabled
+    _enabled = enabled
+
+
+def _fmt_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    inner = ",".join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in items)
+    return "{" + inner + "}"
+
+
+class PrometheusExporter:
+    """Renders the registry in the Prometheus text exposition format"""
+
+    def export(self, reg):
+        lines = []
+        for name in sorted({key[0] for key in reg.counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (key_name, labels), value in sorted(reg.counters.items()):
+                if key_name == name:
+                    lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        for name in sorted({key[0] for key in reg.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (key_name, labels), hist in sorted(reg.histograms.items()):
+                if key_name != name:
+                    continue
+                for bound, total in hist.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, le=le)} {total}")
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+class LogExporter:
+    """Writes one summary log line per metric"""
+
+    def __init__(self, log=None, level=logging.INFO):
+        self.log = log or logger
+        self.level = level
+
+    def export(self, reg):
+        for (name, labels), value in sorted(reg.counters.items()):
+            self.log.log(self.level, "%s%s count=%s", name, _fmt_labels(labels), value)
+        for (name, labels), hist in sorted(reg.histograms.items()):
+            mean = hist.sum / hist.count if hist.count else 0.0
+            self.log.log(
+                self.level,
+                "%s%s count=%i sum=%.6f mean=%.6f",
+                name,
+                _fmt_labels(labels),
+                hist.count,
+                hist.sum,
+                mean,
+            )
+
+
+EXPORTERS = {
+    "prometheus": PrometheusExporter,
+    "log": LogExporter,
+}
+
+
+_re_string = re.compile(r"'(?:[^']|'')*'")
+_re_number = re.compile(r"\b\d+(?:\.\d+)?\b")
+_re_in_list = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_re_space = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """Replace literals with placeholders so similar queries group together"""
+    sql = _re_string.sub("?", statement)
+    sql = _re_number.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"%\(\w+\)s", "?", sql)
+    sql = _re_in_list.sub("(?)", sql)
+    return _re_space.sub(" ", sql).strip()
+
+
+def _statement_type(statement):
+    head = statement.lstrip().split(None, 1)
+    return head[0].upper() if head else ""
+
+
+def instrument_engine(engine, reg=registry, slow_query_seconds=None):
+    """
+    Record per-statement latency and row counts, log slow queries and time
+    how long callers wait for a pooled connection. Like `timed`, this records
+    nothing while metrics are disabled, see `set_enabled`.
+    """
+    from sqlalchemy import event
+
+    if getattr(engine, "_modep_instrumented", False):
+        return engine
+    if slow_query_seconds is None:
+        slow_query_seconds = settings.SLOW_QUERY_SECONDS
+    # statement -> (type, latency histogram, rows histogram), the set of
+    # distinct statements is small since SQLAlchemy uses bound parameters
+    statements = {}
+
+    def lookup(statement):
+        found = statements.get(statement)
+        if found is None:
+            stmt_type = _statement_type(statement)
+            found = (
+                stmt_type,
+                reg.histogram("modep_sql_seconds", statement=stmt_type),
+                reg.histogram("modep_sql_rows", ROW_BUCKETS, statement=stmt_type),
+            )
+            if len(statements) < MAX_CACHED_STATEMENTS:
+                statements[statement] = found
+        return found
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        if context is not None and is_enabled():
+            context._modep_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_modep_query_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        stmt_type, seconds_hist, rows_hist = lookup(statement)
+        rowcount = getattr(cursor, "rowcount", -1)
+        with reg.lock:
+            seconds_hist.observe(elapsed)
+            if rowcount is not None and rowcount >= 0:
+                rows_hist.observe(rowcount)
+        if elapsed >= slow_query_seconds:
+            reg.inc("modep_sql_slow_total", statement=stmt_type)
+            logger.warning("Slow query (%.3fs): %s", elapsed, normalize_sql(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if is_enabled():
+            reg.inc("modep_sql_errors_total")
+
+    # wrapped on the engine rather than the pool, engine.dispose() (e.g.
+    # after a fork) replaces the pool but keeps the engine
+    raw_connection = engine.raw_connection
+
+    @functools.wraps(raw_connection)
+    def timed_raw_connection(*args, **kwargs):
+        if not is_enabled():
+            return raw_connection(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            reg.observe("modep_sql_pool_wait_seconds", time.perf_counter() - start)
+
+    engine.raw_connection = timed_raw_connection
+    engine._modep_instrumented = True
+    return engine
+
+
+def timed(name, reg=registry, size=None):
+    """
+    Decorator recording the duration of every call as `<name>_seconds` and
+    failures as `<name>_errors_total`. If `size` is given it's called with
+    the wrapped function's arguments and return value to get a byte count,
+    which is recorded as `<name>_bytes` along with the throughput.
+
+    Nothing is recorded while metrics are disabled, see `set_enabled`.
+    """
+
+    def decorator(func):
+        op = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                reg.inc(f"{name}_errors_total", op=op)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                reg.observe(f"{name}_seconds", elapsed, op=op)
+            if size is not None:
+                try:
+                    nbytes = size(result, *args, **kwargs)
+                except Exception:
+                    # metrics must never break the call they measure
+                    logger.debug("Failed to get size for %s", op, exc_info=True)
+                    nbytes = None
+                if nbytes is not None:
+                    reg.observe(f"{name}_bytes", nbytes, SIZE_BUCKETS, op=op)
+                    if elapsed > 0:
+                        reg.observe(
+                            f"{name}_bytes_per_second",
+                            nbytes / elapsed,
+                            SIZE_BUCKETS,
+                            op=op,
+                        )
+            return result
+
+        return wrapper
+
+    return decorator
@@ -9,8 +9,7 @@ from flask import Flask
 from flask_login import AnonymousUserMixin, UserMixin
 from flask_sqlalchemy import SQLAlchemy
 
-from modep_common import settings
-from modep_common.io import StorageClient
+from modep_common import metrics, settings
 
 
 logger = logging.getLogger(__name__)
@@ -25,6 +24,12 @@ def get_app_and_db():
     app.config["CELERY_BROKER_URL"] = os.environ.get("CELERY_BROKER_URL", None)
     app.config["CELERY_RESULT_BACKEND"] = os.environ.get("CELERY_RESULT_BACKEND", None)
     db = SQLAlchemy(app)
+    # imported here, modep_common.quota imports the models
+    from modep_common.quota import init_quota
+
+    init_quota()
+    if metrics.is_enabled():
+        metrics.instrument_engine(db.get_engine(app))
     return app, db
 
 
@@ -222,6 +227,10 @@ class TabularFramework(TimestampMixin, StatusMixin, db.Model):
         self.experiment_id = experiment_id
 
     def delete_remote(self):
+        # google.cloud.storage is slow to import and most users of the models
+        # never touch the bucket
+        from modep_common.io import StorageClient
+
         sc = StorageClient()
 
         # delete outdir zip
@@ -465,6 +474,19 @@ class UserQuota(TimestampMixin, db.Model):
         self.max_runtime_seconds = tier.max_runtime_seconds
 
 
+class UserJobCounter(db.Model):
+    """Number of active jobs per user, see `modep_common.quota`"""
+
+    user_pk = db.Column(
+        db.Integer, db.ForeignKey("user.pk", ondelete="CASCADE"), primary_key=True
+    )
+    active = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, user_pk, active=0):
+        self.user_pk = user_pk
+        self.active = active
+
+
 def test_db():
     app, db = get_app_and_db()
     with app.app_context():
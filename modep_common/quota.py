@@ -0,0 +1,201 @@
+"""
+Admission control for `UserQuota.concurrency`
+
+Instead of counting a user's running `TabularFramework` rows on every
+submission, each user has a `UserJobCounter` row holding the number of their
+jobs in an active status. The counter follows the jobs: a flush that moves
+a job into or out of the active statuses (including inserting or deleting
+one) changes the counter in the same transaction, so plain
+`job.status = ...` assignments keep it right. The transition is checked
+against the committed row, two sessions finishing the same job count it
+once. The flush hook is registered by `init_quota`.
+
+Admission goes through `acquire_slot`, which takes the slot with a single
+conditional UPDATE, so concurrent submissions can't over-admit. Restarting
+a finished job should go through it too, a plain assignment back to an
+active status is counted but not checked against the quota:
+
+    job = TabularFramework(user_pk=user.pk, ...)
+    if not quota.acquire_slot(job, user_quota.concurrency):
+        db.session.rollback()
+        abort(429)
+    db.session.commit()
+
+Bulk `Query.update()` calls and database-side cascades bypass the session,
+`reconcile` recounts a user's counter from the jobs table after those.
+"""
+import logging
+
+from sqlalchemy import case, event, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, attributes
+
+from modep_common.enums import JobStatus
+from modep_common.models import TabularFramework, UserJobCounter, db
+
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = (
+    JobStatus.CREATED.name,
+    JobStatus.STARTING.name,
+    JobStatus.RUNNING.name,
+    JobStatus.STOPPING.name,
+)
+
+
+def _count_active(user_pk):
+    return TabularFramework.query.filter(
+        TabularFramework.user_pk == user_pk,
+        TabularFramework.status.in_(ACTIVE_STATUSES),
+    ).count()
+
+
+def _try_increment(user_pk, concurrency):
+    query = UserJobCounter.query.filter(UserJobCounter.user_pk == user_pk)
+    if concurrency is not None:
+        query = query.filter(UserJobCounter.active < concurrency)
+    updated = query.update(
+        {UserJobCounter.active: UserJobCounter.active + 1},
+        synchronize_session=False,
+    )
+    return updated == 1
+
+
+def _create_counter(user_pk):
+    """Create the counter from the user's current active jobs (one-off scan)"""
+    try:
+        with db.session.begin_nested():
+            db.session.add(UserJobCounter(user_pk, active=_count_active(user_pk)))
+    except IntegrityError:
+        # created by a concurrent submission
+        pass
+
+
+def _acquired(session, create=False):
+    """
+    Jobs whose slot `acquire_slot` already counted in the current transaction,
+    forgotten when it ends
+    """
+    transaction = session.get_transaction()
+    if transaction is None or session.info.get("quota_transaction") is not transaction:
+        if not create:
+            return set()
+        session.info["quota_transaction"] = transaction
+        session.info["quota_acquired"] = set()
+    return session.info["quota_acquired"]
+
+
+def acquire_slot(job, concurrency):
+    """
+    Take one of the user's `concurrency` job slots for `job`, returns False if
+    they're all in use. `concurrency=None` means no limit. On success the job
+    is added to the session with status CREATED (unless it's already active).
+    """
+    init_quota()
+    session = db.session()
+    if job in _acquired(session):
+        return True
+    if job.status in ACTIVE_STATUSES and attributes.instance_state(job).persistent:
+        # already counted
+        return True
+
+    with session.no_autoflush:
+        granted = _try_increment(job.user_pk, concurrency)
+        if not granted:
+            if UserJobCounter.query.get(job.user_pk) is not None:
+                logger.info(
+                    "Concurrency quota of %s reached for user_pk=%s",
+                    concurrency,
+                    job.user_pk,
+                )
+                return False
+            _create_counter(job.user_pk)
+            granted = _try_increment(job.user_pk, concurrency)
+    if not granted:
+        return False
+
+    _acquired(session, create=True).add(job)
+    if job.status not in ACTIVE_STATUSES:
+        job.status = JobStatus.CREATED.name
+    session.add(job)
+    return True
+
+
+def reconcile(user_pk):
+    """Reset the counter from the jobs table, e.g. after bulk status updates"""
+    active = _count_active(user_pk)
+    updated = UserJobCounter.query.filter(UserJobCounter.user_pk == user_pk).update(
+        {UserJobCounter.active: active}, synchronize_session=False
+    )
+    if not updated:
+        _create_counter(user_pk)
+    return active
+
+
+def _claim_status(session, job, is_active):
+    """
+    Write the job's new status only if the row is on the other side of the
+    active statuses, returns whether the row was active before. The check is
+    against the committed row rather than the status this session loaded, so
+    of several sessions finishing (or restarting) the same job only one gets
+    to count the transition.
+    """
+    table = TabularFramework.__table__
+    if is_active:
+        was = or_(table.c.status.is_(None), table.c.status.notin_(ACTIVE_STATUSES))
+    else:
+        was = table.c.status.in_(ACTIVE_STATUSES)
+    # deleted rows get a NULL status first, the ORM deletes them right after
+    status = None if job in session.deleted else job.status
+    result = session.execute(
+        table.update().where(table.c.pk == job.pk).where(was).values(status=status)
+    )
+    return (result.rowcount == 1) != is_active
+
+
+def _count_transitions(session, flush_context, instances):
+    acquired = _acquired(session)
+    deltas = {}
+
+    for job in session.new | session.dirty | session.deleted:
+        if not isinstance(job, TabularFramework):
+            continue
+        is_active = job.status in ACTIVE_STATUSES and job not in session.deleted
+        counted = 0
+        if job in acquired:
+            # acquire_slot counted the job as active already
+            acquired.discard(job)
+            counted += 1
+        if attributes.instance_state(job).persistent:
+            if (
+                job in session.deleted
+                or attributes.get_history(job, "status").has_changes()
+            ):
+                counted += _claim_status(session, job, is_active)
+            elif job.status in ACTIVE_STATUSES:
+                counted += 1
+        delta = int(is_active) - counted
+        if delta:
+            deltas[job.user_pk] = deltas.get(job.user_pk, 0) + delta
+
+    for user_pk, delta in deltas.items():
+        if user_pk is None or delta == 0:
+            continue
+        # a missing counter is fine, _create_counter counts the jobs table.
+        # Never below zero, if the counter drifted reconcile fixes it
+        active = UserJobCounter.active + delta
+        session.execute(
+            UserJobCounter.__table__.update()
+            .where(UserJobCounter.user_pk == user_pk)
+            .values(active=case((active < 0, 0), else_=active))
+        )
+
+
+def init_quota():
+    """
+    Keep `UserJobCounter` in step with job status changes, called by
+    `get_app_and_db` and `acquire_slot`. Safe to call more than once.
+    """
+    if not event.contains(Session, "before_flush", _count_transitions):
+        event.listen(Session, "before_flush", _count_transitions)
@@ -1,14 +1,40 @@
+"""
+Settings are read from the environment when they're accessed rather than
+when this module is imported, e.g. `settings.GCP_BUCKET`
+"""
 import os
 
 
-DB_HOST = os.environ.get("DB_HOST", "localhost")
-DB_PORT = os.environ.get("DB_PORT", "5432")
-DB_USER = os.environ.get("DB_USER", "")
-DB_PASS = os.environ.get("DB_PASS", "")
-DB_NAME = os.environ.get("DB_NAME", "")
+def _env(name, default):
+    return lambda: os.environ.get(name, default)
 
-SQLALCHEMY_DATABASE_URI = (
-    f"postgresql://{DB_HOST}:{DB_PORT}/{DB_NAME}?user={DB_USER}&password={DB_PASS}"
-)
 
-GCP_BUCKET = os.environ.get("GCP_BUCKET", "")
+def _database_uri():
+    keys = ("DB_HOST", "DB_PORT", "DB_NAME", "DB_USER", "DB_PASS")
+    host, port, name, user, password = (__getattr__(key) for key in keys)
+    return f"postgresql://{host}:{port}/{name}?user={user}&password={password}"
+
+
+_SETTINGS = {
+    "DB_HOST": _env("DB_HOST", "localhost"),
+    "DB_PORT": _env("DB_PORT", "5432"),
+    "DB_USER": _env("DB_USER", ""),
+    "DB_PASS": _env("DB_PASS", ""),
+    "DB_NAME": _env("DB_NAME", ""),
+    "SQLALCHEMY_DATABASE_URI": _database_uri,
+    "GCP_BUCKET": _env("GCP_BUCKET", ""),
+    "METRICS_ENABLED": lambda: os.environ.get("METRICS_ENABLED", "1") == "1",
+    "METRICS_EXPORTER": _env("METRICS_EXPORTER", "prometheus"),
+    "SLOW_QUERY_SECONDS": lambda: float(os.environ.get("SLOW_QUERY_SECONDS", "0.5")),
+}
+
+
+def __getattr__(name):
+    try:
+        return _SETTINGS[name]()
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_SETTINGS))
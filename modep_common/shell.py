@@ -1,10 +1,13 @@
 import logging
 import subprocess
 
+from modep_common.metrics import timed
+
 
 logger = logging.getLogger(__name__)
 
 
+@timed("modep_shell")
 def run_cmd(cmd):
     """Run a shell command and print the output as it runs"""
     logger.debug("$ %s", cmd)
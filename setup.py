@@ -19,6 +19,7 @@ setup(
         'google-resumable-media==1.3.0',
         'googleapis-common-protos==1.53.0',
         'psycopg2-binary==2.8.6',
+        'pyarrow==14.0.1',
         'PyYAML==5.4.1',
         'SQLAlchemy==1.4.17',
         'Werkzeug==2.0.1',